@@ -3,6 +3,7 @@ Configuration settings for Invoice Processor CDK deployment
 """
 import os
 import yaml
+from functools import lru_cache
 from pathlib import Path
 
 class Config:
@@ -14,7 +15,7 @@ class Config:
         config_path = Path(__file__).parent / "config.yaml"
         
         with open(config_path, 'r') as file:
-            config_data = yaml.safe_load(file)
+            config_data = yaml.load(file, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
         
         # AWS Configuration
         aws_config = config_data.get('aws', {})
@@ -33,22 +34,27 @@ class Config:
         # Bedrock Configuration
         bedrock_config = config_data.get('bedrock', {})
         self.NOVA_LITE_MODEL = bedrock_config.get('nova_lite_model', 'us.amazon.nova-lite-v1:0')
-        self.CLAUDE_SONNET_MODEL = bedrock_config.get('claude_sonnet_model', 'anthropic.claude-3-5-sonnet-20241022-v2:0')
-        self.CLAUDE_HAIKU_MODEL = bedrock_config.get('claude_haiku_model', 'anthropic.claude-3-haiku-20240307-v1:0')
+        self.CLAUDE_SONNET_MODEL = bedrock_config.get('claude_sonnet_model', 'us.amazon.nova-lite-v1:0')
+        self.CLAUDE_HAIKU_MODEL = bedrock_config.get('claude_haiku_model', 'us.amazon.nova-lite-v1:0')
+        self.EXTRACTION_HEDGING = bedrock_config.get('extraction_hedging', True)
+        self.EXTRACTION_HEDGE_DELAY = bedrock_config.get('extraction_hedge_delay', 8)
         
         # Lambda Configuration
         lambda_config = config_data.get('lambda', {})
         self.LAMBDA_TIMEOUT = lambda_config.get('timeout', 300)
         self.LAMBDA_MEMORY = lambda_config.get('memory', 1024)
         self.LAMBDA_RUNTIME = lambda_config.get('runtime', 'python3.13')
+        self.LAMBDA_PROVISIONED_CONCURRENCY = lambda_config.get('provisioned_concurrency', 0)
         
         # API Gateway Configuration
         api_config = config_data.get('api', {})
         self.API_NAME = api_config.get('name', 'InvoiceProcessorAPI')
+        self.API_MIN_COMPRESSION_SIZE = api_config.get('min_compression_size', 1024)
         cors_config = api_config.get('cors', {})
         self.API_CORS_ALLOW_ORIGINS = cors_config.get('allow_origins', ['*'])
         self.API_CORS_ALLOW_METHODS = cors_config.get('allow_methods', ['GET', 'POST', 'OPTIONS'])
         self.API_CORS_ALLOW_HEADERS = cors_config.get('allow_headers', ['Content-Type', 'Authorization'])
+        self.API_CORS_MAX_AGE = cors_config.get('max_age', 86400)
         
         # CloudFront Configuration
         cloudfront_config = config_data.get('cloudfront', {})
@@ -90,6 +96,7 @@ class Config:
         base_name = self.S3_INVOICE_BUCKET if bucket_type == 'invoice' else self.S3_FRONTEND_BUCKET
         return f"{base_name}-{self.AWS_ACCOUNT}-{self.AWS_REGION}"
 
+@lru_cache(maxsize=None)
 def get_config():
-    """Get configuration instance"""
+    """Get configuration instance, parsed once per process"""
     return Config()
\ No newline at end of file
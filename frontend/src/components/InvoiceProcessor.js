@@ -1,6 +1,9 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { documentAPI, chatAPI } from '../services/api';
 
+// Number of documents sent to the backend at the same time
+const MAX_CONCURRENT_UPLOADS = 4;
+
 const InvoiceProcessor = ({ files, isProcessing, onProcessed, onProcessingComplete, onSessionCreated }) => {
   const [processingStatus, setProcessingStatus] = useState({});
   const [currentIndex, setCurrentIndex] = useState(0);
@@ -21,7 +24,13 @@ const InvoiceProcessor = ({ files, isProcessing, onProcessed, onProcessingComple
     // Notify parent component about session creation immediately
     onSessionCreated && onSessionCreated(sessionId);
 
-    for (const file of files) {
+    // Upload a few files at once so one slow extraction doesn't hold up the rest;
+    // results are written by index so they keep the order the files were picked in
+    const results = new Array(files.length);
+    let nextIndex = 0;
+
+    const processFile = async (index) => {
+      const file = files[index];
       try {
         // Convert file to base64
         const fileContent = await fileToBase64(file.file);
@@ -50,7 +59,7 @@ const InvoiceProcessor = ({ files, isProcessing, onProcessed, onProcessingComple
             extraction_metadata: result.extraction_metadata || {},  // Add metadata for page count
             fileBase64: result.file_data || fileContent  // Use file_data from response, fallback to original
           };
-          processedResults.push(resultWithStatus);
+          results[index] = resultWithStatus;
           
           // Update status to completed
           setProcessingStatus(prev => ({
@@ -60,13 +69,13 @@ const InvoiceProcessor = ({ files, isProcessing, onProcessed, onProcessingComple
           
         } else {
           
-          processedResults.push({
+          results[index] = {
             id: file.id,  // Keep file.id for error cases since no document_id from backend
             document_name: file.name,
             status: 'error',
             error: result.error || 'Processing failed',
             data: {}
-          });
+          };
           
           setProcessingStatus(prev => ({
             ...prev,
@@ -75,20 +84,31 @@ const InvoiceProcessor = ({ files, isProcessing, onProcessed, onProcessingComple
         }
       } catch (error) {
         
-        processedResults.push({
+        results[index] = {
           id: file.id,  // Keep file.id for error cases since no document_id from backend
           document_name: file.name,
           status: 'error',
           error: error.message || 'Processing failed',
           data: {}
-        });
+        };
         
         setProcessingStatus(prev => ({
           ...prev,
           [file.id]: 'error'
         }));
       }
-    }
+    };
+
+    const processNext = async () => {
+      while (nextIndex < files.length) {
+        const index = nextIndex++;
+        await processFile(index);
+      }
+    };
+
+    const workers = Array.from({ length: Math.min(MAX_CONCURRENT_UPLOADS, files.length) }, processNext);
+    await Promise.all(workers);
+    processedResults.push(...results);
 
     // Update processed invoices
     onProcessed(processedResults);
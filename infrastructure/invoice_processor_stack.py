@@ -4,7 +4,8 @@ from aws_cdk import (
     aws_s3 as s3,
     aws_iam as iam,
     aws_lambda as lambda_,
-    aws_apigateway as apigateway,
+    aws_apigatewayv2 as apigwv2,
+    aws_apigatewayv2_integrations as apigwv2_integrations,
     aws_cloudfront as cloudfront,
     aws_cloudfront_origins as origins,
     aws_s3_deployment as s3deploy,
@@ -80,10 +81,18 @@ class InvoiceProcessorStack(Stack):
                 "image": lambda_.Runtime.PYTHON_3_9.bundling_image,
                 "command": [
                     "bash", "-c",
-                    "pip install -r requirements.txt -t /asset-output/python"
+                    # Fetch Graviton wheels regardless of the build host's architecture, then
+                    # drop test suites and console scripts the layer never imports. Bytecode
+                    # is kept: /opt is read-only, so missing .pyc files would be recompiled
+                    # in memory on every cold start.
+                    "pip install --no-cache-dir -r requirements.txt -t /asset-output/python "
+                    "--platform manylinux2014_aarch64 --implementation cp --python-version 3.9 --only-binary=:all: "
+                    "&& find /asset-output/python -type d -name tests -prune -exec rm -rf {} + "
+                    "&& rm -rf /asset-output/python/bin"
                 ]
             }),
             compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+            compatible_architectures=[lambda_.Architecture.ARM_64],
             description="Python dependencies for invoice processing"
         )
         
@@ -91,9 +100,13 @@ class InvoiceProcessorStack(Stack):
         invoice_lambda = lambda_.Function(
             self, "InvoiceProcessorLambda",
             runtime=lambda_.Runtime.PYTHON_3_9,
-            architecture=lambda_.Architecture.X86_64,
+            architecture=lambda_.Architecture.ARM_64,
             handler="lambda_function.lambda_handler",
-            code=lambda_.Code.from_asset("lambda"),
+            # Dependencies come from the layer; ship only the handler source
+            code=lambda_.Code.from_asset(
+                "lambda",
+                exclude=["**/__pycache__", "**/*.pyc", "requirements.txt"]
+            ),
             timeout=Duration.seconds(self.config.LAMBDA_TIMEOUT),
             memory_size=self.config.LAMBDA_MEMORY,
             role=lambda_role,
@@ -102,50 +115,61 @@ class InvoiceProcessorStack(Stack):
                 "S3_BUCKET_NAME": invoice_bucket.bucket_name,
                 "NOVA_LITE_MODEL": self.config.NOVA_LITE_MODEL,
                 "CLAUDE_SONNET_MODEL": self.config.CLAUDE_SONNET_MODEL,
-                "CLAUDE_HAIKU_MODEL": self.config.CLAUDE_HAIKU_MODEL
+                "CLAUDE_HAIKU_MODEL": self.config.CLAUDE_HAIKU_MODEL,
+                "EXTRACTION_HEDGING": str(self.config.EXTRACTION_HEDGING).lower(),
+                "EXTRACTION_HEDGE_DELAY": str(self.config.EXTRACTION_HEDGE_DELAY),
+                "RESPONSE_MIN_COMPRESSION_SIZE": str(self.config.API_MIN_COMPRESSION_SIZE)
             }
         )
 
-        # API Gateway
-        api = apigateway.RestApi(
+        # API Gateway (HTTP API); CORS preflights are answered by the gateway itself
+        api = apigwv2.HttpApi(
             self, "InvoiceProcessorApi",
-            rest_api_name=self.config.API_NAME,
-            default_cors_preflight_options=apigateway.CorsOptions(
+            api_name=self.config.API_NAME,
+            cors_preflight=apigwv2.CorsPreflightOptions(
                 allow_origins=self.config.API_CORS_ALLOW_ORIGINS,
-                allow_methods=self.config.API_CORS_ALLOW_METHODS,
-                allow_headers=self.config.API_CORS_ALLOW_HEADERS
+                allow_methods=[apigwv2.CorsHttpMethod[method] for method in self.config.API_CORS_ALLOW_METHODS],
+                allow_headers=self.config.API_CORS_ALLOW_HEADERS,
+                max_age=Duration.seconds(self.config.API_CORS_MAX_AGE)
             )
         )
-
-        # Grant API Gateway permission to invoke Lambda
-        invoice_lambda.add_permission(
-            "ApiGatewayInvoke",
-            principal=iam.ServicePrincipal("apigateway.amazonaws.com"),
-            action="lambda:InvokeFunction",
-            source_arn=f"{api.arn_for_execute_api()}/*/*"
-        )
         
         # Lambda integration
-        lambda_integration = apigateway.LambdaIntegration(invoice_lambda)
-        
-        # API Gateway resources and methods
-        # /process-document
-        process_resource = api.root.add_resource("process-document")
-        process_resource.add_method("POST", lambda_integration)
-        
-        # /update-document
-        update_resource = api.root.add_resource("update-document")
-        update_resource.add_method("POST", lambda_integration)
-        
-        # /chat
-        chat_resource = api.root.add_resource("chat")
-        chat_resource.add_method("POST", lambda_integration)
+        # Serve through a provisioned alias when configured so requests skip cold starts
+        if self.config.LAMBDA_PROVISIONED_CONCURRENCY > 0:
+            invoice_target = lambda_.Alias(
+                self, "InvoiceProcessorLiveAlias",
+                alias_name="live",
+                version=invoice_lambda.current_version,
+                provisioned_concurrent_executions=self.config.LAMBDA_PROVISIONED_CONCURRENCY
+            )
+        else:
+            invoice_target = invoice_lambda
+        lambda_integration = apigwv2_integrations.HttpLambdaIntegration(
+            "InvoiceProcessorIntegration", invoice_target
+        )
         
-        # /session/{sessionId}/delete
-        session_resource = api.root.add_resource("session")
-        session_id_resource = session_resource.add_resource("{sessionId}")
-        delete_resource = session_id_resource.add_resource("delete")
-        delete_resource.add_method("DELETE", lambda_integration)
+        # API Gateway routes
+        api.add_routes(
+            path="/process-document",
+            methods=[apigwv2.HttpMethod.POST],
+            integration=lambda_integration
+        )
+        api.add_routes(
+            path="/update-document",
+            methods=[apigwv2.HttpMethod.POST],
+            integration=lambda_integration
+        )
+        api.add_routes(
+            path="/chat",
+            methods=[apigwv2.HttpMethod.POST],
+            integration=lambda_integration
+        )
+        api.add_routes(
+            path="/session/{sessionId}/delete",
+            methods=[apigwv2.HttpMethod.DELETE],
+            integration=lambda_integration
+        )
 
         # Frontend S3 bucket
         frontend_bucket = s3.Bucket(
@@ -189,17 +213,37 @@ class InvoiceProcessorStack(Stack):
         # Grant CloudFront OAI access to S3 bucket
         frontend_bucket.grant_read(oai)
 
-        # Deploy React build to S3
-        s3deploy.BucketDeployment(
+        # Deploy React build to S3. Files under static/ have content hashes in
+        # their names, so browsers and CloudFront can keep them indefinitely;
+        # old hashes are left in place for clients still holding an old index.html
+        static_deployment = s3deploy.BucketDeployment(
+            self, "DeployFrontendStatic",
+            sources=[s3deploy.Source.asset("frontend/build")],
+            destination_bucket=frontend_bucket,
+            exclude=["*"],
+            include=["static/*"],
+            prune=False,
+            cache_control=[
+                s3deploy.CacheControl.set_public(),
+                s3deploy.CacheControl.max_age(Duration.days(365)),
+                s3deploy.CacheControl.immutable()
+            ]
+        )
+        
+        # Everything else (index.html, asset manifest) must be revalidated, and only
+        # the entry points need invalidating once the new hashed assets exist
+        frontend_deployment = s3deploy.BucketDeployment(
             self, "DeployFrontend",
             sources=[s3deploy.Source.asset("frontend/build")],
             destination_bucket=frontend_bucket,
+            exclude=["static/*"],
             distribution=distribution,
-            distribution_paths=["/*"],
+            distribution_paths=["/", "/index.html", "/asset-manifest.json"],
             cache_control=[
                 s3deploy.CacheControl.no_cache()
             ]
         )
+        frontend_deployment.node.add_dependency(static_deployment)
 
         # Outputs
         CfnOutput(
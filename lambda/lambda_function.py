@@ -1,16 +1,53 @@
-import json
+import logging
 import os
 import boto3
+import orjson
+from botocore.config import Config
 import base64
-import tempfile
+import gzip
+import io
 import hashlib
+import re
+import textwrap
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
 from typing import Dict, Any
 from pypdf import PdfReader
+import pypdfium2 as pdfium
+from charset_normalizer import from_bytes
 
-# Initialize AWS clients
-s3_client = boto3.client('s3')
-bedrock_client = boto3.client('bedrock-runtime')
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+# Initialize AWS clients. TCP keepalive stops idle warm containers from losing
+# their pooled connections; the larger pool leaves room for concurrent calls.
+AWS_CLIENT_CONFIG = Config(tcp_keepalive=True, max_pool_connections=32)
+# Bedrock throttles under bursts of uploads; adaptive mode backs off and
+# rate-limits client-side instead of failing the extraction on the first 429
+BEDROCK_CLIENT_CONFIG = AWS_CLIENT_CONFIG.merge(Config(
+    retries={'max_attempts': 6, 'mode': 'adaptive'},
+    connect_timeout=5,
+    read_timeout=60
+))
+s3_client = boto3.client('s3', config=AWS_CLIENT_CONFIG)
+bedrock_client = boto3.client('bedrock-runtime', config=BEDROCK_CLIENT_CONFIG)
+
+def _prewarm_operation_models():
+    """Build the operation models this handler calls, which botocore otherwise builds lazily on first use"""
+    for client, operations in (
+        (bedrock_client, ('InvokeModel',)),
+        (s3_client, ('GetObject', 'PutObject', 'ListObjectsV2', 'DeleteObjects'))
+    ):
+        for operation in operations:
+            client.meta.service_model.operation_model(operation)
+
+# Done during init so a cold request doesn't pay for it
+_prewarm_operation_models()
+
+# Shared pool for overlapping independent Bedrock/S3 calls within an invocation
+executor = ThreadPoolExecutor(max_workers=8)
 
 # Environment variables
 S3_BUCKET = os.environ['S3_BUCKET_NAME']
@@ -18,111 +55,208 @@ NOVA_LITE_MODEL = os.environ['NOVA_LITE_MODEL']
 CLAUDE_SONNET_MODEL = os.environ['CLAUDE_SONNET_MODEL']
 CLAUDE_HAIKU_MODEL = os.environ['CLAUDE_HAIKU_MODEL']
 
+# Bounds on the invoice data sent with each chat question
+MAX_CHAT_LINE_ITEMS = 50
+MAX_CHAT_CONTEXT_CHARS = 80000
+# Cache points per chat request, placed after the most recent documents;
+# Bedrock accepts at most four
+CHAT_CACHE_POINTS = 4
+
+# Seconds to wait on Nova Lite before also starting the Sonnet fallback; with
+# hedging off, Sonnet only runs after Nova Lite fails
+EXTRACTION_HEDGING = os.environ.get('EXTRACTION_HEDGING', 'true').lower() == 'true'
+EXTRACTION_HEDGE_DELAY = float(os.environ.get('EXTRACTION_HEDGE_DELAY', '8'))
+
+# Document metadata read by this execution environment, keyed by S3 key and
+# stored with its ETag so warm chat turns only fetch new or edited documents;
+# least recently used entries are evicted first
+METADATA_CACHE_SIZE = 1000
+_metadata_cache = OrderedDict()
+
+# Extraction results keyed by a hash of the models and normalized document
+# text, so re-uploading the same invoice to a warm container skips Bedrock
+EXTRACTION_CACHE_SIZE = 256
+_extraction_cache = OrderedDict()
+
+# Fields a complete extraction fills in, used to rank partial results
+EXTRACTION_FIELDS = ('vendor_name', 'invoice_number', 'total_amount', 'date', 'payment_terms', 'line_items')
+
+# Documents longer than this are reduced to header, footer and lines that look
+# like invoice fields before extraction; shorter ones are sent whole
+EXTRACTION_TEXT_LIMIT = 12000
+EXTRACTION_HEAD_LINES = 20
+EXTRACTION_TAIL_LINES = 10
+EXTRACTION_LINE_WIDTH = 200
+RELEVANT_LINE_PATTERN = re.compile(
+    r"\d[\d,]*\.\d{2}"
+    r"|\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}"
+    r"|\b(?:invoice|total|subtotal|tax|terms|due|bill|vendor|remit|qty|quantity|unit|rate|amount)\b",
+    re.IGNORECASE
+)
+
+# HTTP APIs don't compress responses, so bodies at least this large are
+# gzipped here when the client accepts it
+RESPONSE_MIN_COMPRESSION_SIZE = int(os.environ.get('RESPONSE_MIN_COMPRESSION_SIZE', '1024'))
+
+# Headers sent with every API response; shared, so callers must not mutate them
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,DELETE',
+    'Content-Type': 'application/json'
+}
+
+CORS_PREFLIGHT_RESPONSE = {
+    'statusCode': 200,
+    'headers': CORS_HEADERS,
+    'body': ''
+}
+
+# Structural tokens for locating the JSON object in a model reply: whole string
+# literals (so braces inside them are skipped), a lone unterminated quote, or a brace
+JSON_STRUCTURE_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|"|[{}]', re.DOTALL)
+
+# Pieces of an amount string: currency symbols, whitespace and ISO currency
+# codes to strip, thousands grouping with either separator, and the final number
+CURRENCY_PATTERN = re.compile(r"[\s$\u20ac\u00a3\u00a5]|(?<![A-Za-z])[A-Za-z]{3}(?![A-Za-z])")
+COMMA_GROUPING_PATTERN = re.compile(r"\d{1,3}(?:,\d{3})+")
+DOT_GROUPING_PATTERN = re.compile(r"\d{1,3}(?:\.\d{3}){2,}")
+AMOUNT_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+
+# Fixed extraction instructions, sent as a cached system prompt so each call
+# only adds the document text
+NOVA_SYSTEM_PROMPT = """Extract invoice data from the text the user sends and return ONLY valid JSON.
+
+Return this exact structure:
+{
+  "vendor_name": "company name",
+  "invoice_number": "number",
+  "total_amount": 123.45,
+  "date": "YYYY-MM-DD",
+  "payment_terms": "terms",
+  "line_items": [
+    {
+      "description": "item description",
+      "quantity": 1,
+      "rate": 100.00,
+      "amount": 100.00
+    }
+  ]
+}"""
+
+SONNET_SYSTEM_PROMPT = """Extract structured data from the invoice text the user sends.
+
+Return valid JSON with vendor_name, invoice_number, total_amount, date, payment_terms, and line_items."""
+
+# Chat instructions, sent ahead of the session documents so they never change
+# the cached prefix
+CHAT_SYSTEM_PROMPT = """You are analyzing invoice data. Answer the user's question based on the invoice documents that follow, one JSON object per document.
+
+Provide a clear, conversational answer."""
+
+def prime_connections():
+    """Open the Bedrock and S3 connections during init so the first request doesn't pay for them"""
+    try:
+        call_bedrock(NOVA_LITE_MODEL, ".", max_tokens=1, temperature=0)
+        s3_client.head_bucket(Bucket=S3_BUCKET)
+    except Exception:
+        logger.warning("Connection priming failed", exc_info=True)
+
 def lambda_handler(event, context):
     """Main Lambda handler for invoice processing"""
     
+    # HTTP API (payload 2.0) events carry requestContext.http.method and
+    # rawPath; REST API events carry httpMethod and path
+    http_context = (event.get('requestContext') or {}).get('http') or {}
+    method = event.get('httpMethod') or http_context.get('method', '')
+    path = (event.get('path') or event.get('rawPath') or '').rstrip('/')
+    
     # Handle CORS preflight requests
-    if event.get('httpMethod') == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': get_cors_headers(),
-            'body': ''
-        }
+    if method == 'OPTIONS':
+        return CORS_PREFLIGHT_RESPONSE
     
     try:
-        # Parse request
-        path = event.get('path', '').rstrip('/')
-        method = event.get('httpMethod', '')
-        
-        if path == '/process-document' and method == 'POST':
-            return process_document(event)
-        elif path == '/update-document' and method == 'POST':
-            return update_document(event)
-        elif path == '/chat' and method == 'POST':
-            return handle_chat(event)
-        elif path.startswith('/session/') and path.endswith('/delete') and method == 'DELETE':
+        handler = ROUTES.get((path, method))
+        if handler:
+            return compress_response(event, handler(event))
+        if method == 'DELETE' and path.startswith('/session/') and path.endswith('/delete'):
             return delete_session(event)
-        else:
-            return {
-                'statusCode': 404,
-                'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Endpoint not found'})
-            }
+        
+        return {
+            'statusCode': 404,
+            'headers': get_cors_headers(),
+            'body': encode_json({'error': 'Endpoint not found'})
+        }
             
     except Exception as e:
-        pass
+        logger.exception("Unhandled error routing %s %s", method, path)
         return {
             'statusCode': 500,
             'headers': get_cors_headers(),
-            'body': json.dumps({'error': str(e)})
+            'body': encode_json({'error': str(e)})
         }
 
 def process_document(event):
     """Process uploaded document"""
     try:
-        # Parse request body
-        if isinstance(event.get('body'), str):
-            body = json.loads(event['body'])
-        else:
-            body = event.get('body', {})
-            
+        body = parse_request_body(event)
         file_data = body.get('file_data')
         file_name = body.get('file_name')
         session_id = body.get('session_id')
         
         # Generate session_id if not provided
         if not session_id:
-            import uuid
             session_id = str(uuid.uuid4())
         
         if not all([file_data, file_name]):
             return {
                 'statusCode': 400,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Missing required fields: file_data and file_name'})
+                'body': encode_json({'error': 'Missing required fields: file_data and file_name'})
             }
         
         # Decode file
         file_content = base64.b64decode(file_data)
         
+        # Start storing the file now; it does not depend on extraction
+        file_upload = executor.submit(upload_file, file_content, file_name, session_id)
+        
         # Extract text
-        raw_text = extract_text_from_pdf(file_content)
+        if file_content.startswith(b'%PDF-'):
+            raw_text = extract_text_from_pdf(file_content)
+        else:
+            raw_text = decode_text_file(file_content)
         
         # Extract structured data using AI
         structured_data = extract_structured_data(raw_text)
         
         # Store in S3
-        doc_id = store_document(file_content, file_name, session_id, raw_text, structured_data)
+        doc_id = store_document(file_upload, file_name, session_id, raw_text, structured_data)
         
         return {
             'statusCode': 200,
             'headers': get_cors_headers(),
-            'body': json.dumps({
+            'body': encode_json({
                 'success': True,
                 'document_id': doc_id,
                 'session_id': session_id,
                 'structured_data': structured_data,
-                'raw_text': raw_text,
-                'file_data': file_data
+                'raw_text': raw_text
             })
         }
         
     except Exception as e:
+        logger.exception("Failed to process document")
         return {
             'statusCode': 500,
             'headers': get_cors_headers(),
-            'body': json.dumps({'error': str(e)})
+            'body': encode_json({'error': str(e)})
         }
 
 def update_document(event):
     """Update document structured data"""
     try:
-        # Parse request body
-        if isinstance(event.get('body'), str):
-            body = json.loads(event['body'])
-        else:
-            body = event.get('body', {})
-            
+        body = parse_request_body(event)
         document_id = body.get('document_id')
         session_id = body.get('session_id')
         structured_data = body.get('structured_data')
@@ -131,7 +265,7 @@ def update_document(event):
             return {
                 'statusCode': 400,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Missing required fields: document_id, session_id, structured_data'})
+                'body': encode_json({'error': 'Missing required fields: document_id, session_id, structured_data'})
             }
         
         # Update metadata in S3
@@ -143,7 +277,7 @@ def update_document(event):
                 Bucket=S3_BUCKET,
                 Key=metadata_key
             )
-            metadata = json.loads(metadata_response['Body'].read())
+            metadata = orjson.loads(metadata_response['Body'].read())
             
             # Update structured data
             metadata['structured_data'] = structured_data
@@ -153,14 +287,14 @@ def update_document(event):
             s3_client.put_object(
                 Bucket=S3_BUCKET,
                 Key=metadata_key,
-                Body=json.dumps(metadata),
+                Body=orjson.dumps(metadata),
                 ContentType='application/json'
             )
             
             return {
                 'statusCode': 200,
                 'headers': get_cors_headers(),
-                'body': json.dumps({
+                'body': encode_json({
                     'success': True,
                     'message': 'Document updated successfully',
                     'document_id': document_id
@@ -171,25 +305,21 @@ def update_document(event):
             return {
                 'statusCode': 404,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Document not found'})
+                'body': encode_json({'error': 'Document not found'})
             }
         
     except Exception as e:
+        logger.exception("Failed to update document")
         return {
             'statusCode': 500,
             'headers': get_cors_headers(),
-            'body': json.dumps({'error': str(e)})
+            'body': encode_json({'error': str(e)})
         }
 
 def handle_chat(event):
     """Handle chat requests"""
     try:
-        # Parse request body
-        if isinstance(event.get('body'), str):
-            body = json.loads(event['body'])
-        else:
-            body = event.get('body', {})
-            
+        body = parse_request_body(event)
         message = body.get('message')
         session_id = body.get('session_id')
         
@@ -197,7 +327,7 @@ def handle_chat(event):
             return {
                 'statusCode': 400,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Missing message or session_id'})
+                'body': encode_json({'error': 'Missing message or session_id'})
             }
         
         # Get session documents
@@ -207,27 +337,26 @@ def handle_chat(event):
             return {
                 'statusCode': 200,
                 'headers': get_cors_headers(),
-                'body': json.dumps({
+                'body': encode_json({
                     'success': True,
                     'response': "No documents found in this session. Please upload some invoices first."
                 })
             }
         
-        # Create context from all documents
-        context = []
-        for doc in session_docs:
-            context.append({
-                'filename': doc['filename'],
-                'data': doc['structured_data']
-            })
+        # Answer simple aggregate questions directly from the stored data
+        response = answer_aggregation_query(message, session_docs)
         
-        # Generate response using Claude
-        response = generate_chat_response(message, context)
+        if response is None:
+            # Create context from all documents
+            context = build_chat_context(session_docs)
+            
+            # Generate response using Claude
+            response = generate_chat_response(message, context)
         
         return {
             'statusCode': 200,
             'headers': get_cors_headers(),
-            'body': json.dumps({
+            'body': encode_json({
                 'success': True,
                 'response': response,
                 'session_id': session_id
@@ -235,10 +364,11 @@ def handle_chat(event):
         }
         
     except Exception as e:
+        logger.exception("Failed to handle chat request")
         return {
             'statusCode': 500,
             'headers': get_cors_headers(),
-            'body': json.dumps({'error': str(e)})
+            'body': encode_json({'error': str(e)})
         }
 
 def delete_session(event):
@@ -251,211 +381,473 @@ def delete_session(event):
             return {
                 'statusCode': 400,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Missing session ID'})
+                'body': encode_json({'error': 'Missing session ID'})
             }
         
-        # Delete all objects with session prefix
-        response = s3_client.list_objects_v2(
-            Bucket=S3_BUCKET,
-            Prefix=f"sessions/{session_id}/"
-        )
-        
-        if 'Contents' in response:
-            objects_to_delete = [{'Key': obj['Key']} for obj in response['Contents']]
-            s3_client.delete_objects(
+        # Delete all objects with session prefix; each listing page holds at
+        # most 1000 keys, which is also the delete_objects batch limit
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"sessions/{session_id}/"):
+            objects_to_delete = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+            if not objects_to_delete:
+                continue
+            
+            response = s3_client.delete_objects(
                 Bucket=S3_BUCKET,
-                Delete={'Objects': objects_to_delete}
+                Delete={'Objects': objects_to_delete, 'Quiet': True}
             )
+            if response.get('Errors'):
+                raise Exception(f"Failed to delete {len(response['Errors'])} session objects")
         
         return {
             'statusCode': 200,
             'headers': get_cors_headers(),
-            'body': json.dumps({
+            'body': encode_json({
                 'success': True,
                 'message': 'Session deleted successfully'
             })
         }
         
     except Exception as e:
+        logger.exception("Failed to delete session")
         return {
             'statusCode': 500,
             'headers': get_cors_headers(),
-            'body': json.dumps({'error': str(e)})
+            'body': encode_json({'error': str(e)})
         }
 
+# Fixed (path, method) routes; the templated session delete route is matched separately
+ROUTES = {
+    ('/process-document', 'POST'): process_document,
+    ('/update-document', 'POST'): update_document,
+    ('/chat', 'POST'): handle_chat
+}
+
+def parse_request_body(event):
+    """Parse request body from API Gateway (JSON string) or direct invocation (dict)"""
+    body = event.get('body')
+    if isinstance(body, str):
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+        return orjson.loads(body) if body else {}
+    return body or {}
+
 def extract_text_from_pdf(file_content):
+    """Extract text from PDF using PDFium, falling back to pypdf"""
+    try:
+        pdf = pdfium.PdfDocument(file_content)
+        try:
+            pages = []
+            for page in pdf:
+                text_page = page.get_textpage()
+                pages.append(text_page.get_text_range())
+                text_page.close()
+                page.close()
+            return "\n".join(pages).replace("\r\n", "\n").strip()
+        finally:
+            pdf.close()
+    except Exception:
+        logger.warning("PDFium text extraction failed, falling back to pypdf", exc_info=True)
+        return extract_text_with_pypdf(file_content)
+
+def extract_text_with_pypdf(file_content):
     """Extract text from PDF using pypdf"""
     try:
-        with tempfile.NamedTemporaryFile() as temp_file:
-            temp_file.write(file_content)
-            temp_file.flush()
-            
-            with open(temp_file.name, 'rb') as pdf_file:
-                reader = PdfReader(pdf_file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                return text.strip()
+        reader = PdfReader(io.BytesIO(file_content))
+        return "\n".join(page.extract_text() for page in reader.pages).strip()
     except Exception as e:
+        logger.exception("pypdf text extraction failed")
         return f"Error extracting text: {str(e)}"
 
+def decode_text_file(file_content):
+    """Decode a plain-text upload, detecting the encoding only when it is not UTF-8"""
+    try:
+        return file_content.decode('utf-8-sig').strip()
+    except UnicodeDecodeError:
+        best = from_bytes(file_content).best()
+        if best is None:
+            return file_content.decode('utf-8', errors='replace').strip()
+        return str(best).strip()
+
 def extract_structured_data(raw_text):
     """Extract structured data using Nova Lite with Claude fallback"""
     try:
-        # Try Nova Lite first
-        result = call_nova_lite(raw_text)
-        if result and 'vendor_name' in result:
-            return result
+        cache_key = extraction_cache_key(raw_text)
+        cached = _extraction_cache.get(cache_key)
+        if cached:
+            _extraction_cache.move_to_end(cache_key)
+            return cached
         
-        # Fallback to Claude Sonnet
-        result = call_claude_sonnet(raw_text)
-        if result and 'vendor_name' in result:
-            return result
+        prompt_text = select_relevant_lines(raw_text)
+        
+        # Try Nova Lite first
+        futures = [executor.submit(call_nova_lite, prompt_text)]
+        done, _ = wait(futures, timeout=EXTRACTION_HEDGE_DELAY if EXTRACTION_HEDGING else None)
+        
+        # Start Claude Sonnet if Nova failed, or hedge if it is running slow
+        if not done or not is_valid_extraction(futures[0].result()):
+            futures.append(executor.submit(call_claude_sonnet, prompt_text))
+        
+        # Take the first usable result from whichever model finishes, keeping
+        # the most complete partial one in case neither is usable
+        best_partial, best_count = None, 0
+        for future in as_completed(futures):
+            result = future.result()
+            if is_valid_extraction(result):
+                result = normalize_extraction(result)
+                _extraction_cache[cache_key] = result
+                if len(_extraction_cache) > EXTRACTION_CACHE_SIZE:
+                    _extraction_cache.popitem(last=False)
+                return result
+            partial = normalize_extraction(result)
+            count = count_extracted_fields(partial) if partial else 0
+            if count > best_count:
+                best_partial, best_count = partial, count
+        
+        # Partial results are returned but not cached, so a re-upload retries
+        if best_partial:
+            return best_partial
         
         # Manual fallback
         return {'vendor_name': 'Unknown', 'total_amount': 0}
         
     except Exception as e:
+        logger.exception("Structured data extraction failed")
         return {'error': str(e)}
 
-def call_nova_lite(raw_text):
-    """Call Nova Lite for extraction"""
-    try:
-        prompt = f"""Extract invoice data from this text and return ONLY valid JSON:
+def select_relevant_lines(raw_text):
+    """Trim long documents to the lines extraction needs, keeping their order"""
+    if len(raw_text) <= EXTRACTION_TEXT_LIMIT:
+        return raw_text
+    
+    # Wrap overlong lines (single-line text layers, OCR output) so the header,
+    # footer and field matching still have lines to choose between
+    lines = []
+    for line in raw_text.splitlines():
+        if len(line) > EXTRACTION_LINE_WIDTH:
+            lines.extend(textwrap.wrap(line, EXTRACTION_LINE_WIDTH, break_on_hyphens=False))
+        elif line.strip():
+            lines.append(line)
+    
+    # Footer lines are always kept, so their size is reserved up front and the
+    # joined result never exceeds the limit
+    tail_start = max(len(lines) - EXTRACTION_TAIL_LINES, 0)
+    size = sum(len(line) + 1 for line in lines[tail_start:])
+    selected = []
+    for index, line in enumerate(lines[:tail_start]):
+        if index < EXTRACTION_HEAD_LINES or RELEVANT_LINE_PATTERN.search(line):
+            if size + len(line) + 1 > EXTRACTION_TEXT_LIMIT:
+                continue
+            size += len(line) + 1
+            selected.append(line)
+    selected.extend(lines[tail_start:])
+    return "\n".join(selected)
 
-{raw_text}
+def extraction_cache_key(raw_text):
+    """Hash the extraction models and whitespace-normalized text into a cache key"""
+    normalized = ' '.join(raw_text.split())
+    key = f"{NOVA_LITE_MODEL}\n{CLAUDE_SONNET_MODEL}\n{normalized}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
 
-Return this exact structure:
-{{
-  "vendor_name": "company name",
-  "invoice_number": "number",
-  "total_amount": 123.45,
-  "date": "YYYY-MM-DD",
-  "payment_terms": "terms",
-  "line_items": [
-    {{
-      "description": "item description",
-      "quantity": 1,
-      "rate": 100.00,
-      "amount": 100.00
-    }}
-  ]
-}}"""
+def is_valid_extraction(result):
+    """Check that a model extraction has the shape the rest of the app relies on"""
+    if not isinstance(result, dict):
+        return False
+    vendor_name = result.get('vendor_name')
+    if not isinstance(vendor_name, str) or not vendor_name.strip():
+        return False
+    total_amount = result.get('total_amount')
+    if total_amount is not None and parse_amount(total_amount) is None:
+        return False
+    line_items = result.get('line_items')
+    return line_items is None or isinstance(line_items, list)
 
-        response = bedrock_client.invoke_model(
-            modelId=NOVA_LITE_MODEL,
-            body=json.dumps({
-                "messages": [{"role": "user", "content": [{"text": prompt}]}],
-                "inferenceConfig": {"maxTokens": 1000, "temperature": 0.1}
-            })
-        )
-        
-        result = json.loads(response['body'].read())
-        response_text = result['output']['message']['content'][0]['text']
-        
-        # Parse JSON from response
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        if json_start != -1 and json_end > json_start:
-            return json.loads(response_text[json_start:json_end])
-        
+def normalize_extraction(result):
+    """Coerce total_amount to a number and drop malformed fields, or return None if result is not an extraction"""
+    if not isinstance(result, dict):
         return None
+    result = {**result, 'total_amount': parse_amount(result.get('total_amount'))}
+    if not isinstance(result.get('line_items'), (list, type(None))):
+        result['line_items'] = None
+    return result
+
+def count_extracted_fields(result):
+    """Count the invoice fields a model extraction filled in"""
+    return sum(1 for field in EXTRACTION_FIELDS if result.get(field) not in (None, '', []))
+
+def call_nova_lite(raw_text):
+    """Call Nova Lite for extraction"""
+    try:
+        response_text = call_bedrock(
+            NOVA_LITE_MODEL,
+            raw_text,
+            max_tokens=1000,
+            temperature=0.1,
+            system=[{"text": NOVA_SYSTEM_PROMPT}, {"cachePoint": {"type": "default"}}]
+        )
+        return parse_json_response(response_text)
         
     except Exception:
+        logger.warning("Nova Lite extraction failed", exc_info=True)
         return None
 
 def call_claude_sonnet(raw_text):
     """Call Claude Sonnet for extraction"""
     try:
-        prompt = f"""Extract structured data from this invoice text:
-
-{raw_text}
-
-Return valid JSON with vendor_name, invoice_number, total_amount, date, payment_terms, and line_items."""
-        response = bedrock_client.invoke_model(
-            modelId=CLAUDE_SONNET_MODEL,
-            body=json.dumps({
-                "messages": [{"role": "user", "content": [{"text": prompt}]}],
-                "inferenceConfig": {"maxTokens": 2000, "temperature": 0.1}
-            })
+        response_text = call_bedrock(
+            CLAUDE_SONNET_MODEL,
+            raw_text,
+            max_tokens=2000,
+            temperature=0.1,
+            system=[{"text": SONNET_SYSTEM_PROMPT}, {"cachePoint": {"type": "default"}}]
         )
-
-        # response = bedrock_client.invoke_model(
-        #     modelId=CLAUDE_SONNET_MODEL,
-        #     body=json.dumps({
-        #         "anthropic_version": "bedrock-2023-05-31",
-        #         "max_tokens": 2000,
-        #         "temperature": 0.1,
-        #         "messages": [{"role": "user", "content": prompt}]
-        #     })
-        # )
+        return parse_json_response(response_text)
         
-        # result = json.loads(response['body'].read())
-        # response_text = result['content'][0]['text']
+    except Exception:
+        logger.warning("Claude Sonnet extraction failed", exc_info=True)
+        return None
 
-        result = json.loads(response['body'].read())
-        response_text = result['output']['message']['content'][0]['text']
-        
-        # Parse JSON from response
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        if json_start != -1 and json_end > json_start:
-            return json.loads(response_text[json_start:json_end])
-        
+def call_bedrock(model_id, prompt, max_tokens, temperature, system=None):
+    """Invoke a Bedrock model using the Nova messages schema and return the reply text"""
+    request = {
+        "messages": [{"role": "user", "content": [{"text": prompt}]}],
+        "inferenceConfig": {"maxTokens": max_tokens, "temperature": temperature}
+    }
+    if system:
+        request["system"] = system
+    
+    response = bedrock_client.invoke_model(modelId=model_id, body=orjson.dumps(request))
+    result = orjson.loads(response['body'].read())
+    
+    usage = result.get('usage', {})
+    logger.info(
+        "Bedrock usage for %s: input=%s output=%s cache_read=%s cache_write=%s",
+        model_id,
+        usage.get('inputTokens'),
+        usage.get('outputTokens'),
+        usage.get('cacheReadInputTokenCount', 0),
+        usage.get('cacheWriteInputTokenCount', 0)
+    )
+    return result['output']['message']['content'][0]['text']
+
+def parse_json_response(response_text):
+    """Parse the JSON object embedded in a model reply, or return None"""
+    span = find_json_object(response_text)
+    if span:
+        return orjson.loads(response_text[span[0]:span[1]])
+    
+    return None
+
+def find_json_object(text):
+    """Return (start, end) of the first balanced {...} object in text, or None"""
+    start = text.find('{')
+    if start == -1:
         return None
+    
+    depth = 0
+    for token in JSON_STRUCTURE_PATTERN.finditer(text, start):
+        char = token.group()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return start, token.end()
+        elif char == '"':
+            # Unterminated string: the reply was cut off
+            return None
+    
+    return None
+
+def build_chat_context(session_docs):
+    """Serialize session documents for the chat prompt, one block per document, bounded in size"""
+    parts = []
+    used = 0
+    for index, doc in enumerate(session_docs):
+        data = doc['structured_data']
+        line_items = data.get('line_items') if isinstance(data, dict) else None
+        if isinstance(line_items, list) and len(line_items) > MAX_CHAT_LINE_ITEMS:
+            data = {
+                **data,
+                'line_items': line_items[:MAX_CHAT_LINE_ITEMS],
+                'line_items_omitted': len(line_items) - MAX_CHAT_LINE_ITEMS
+            }
         
-    except Exception:
-        return None
+        part = orjson.dumps({'filename': doc['filename'], 'data': data}, default=str).decode()
+        if parts and used + len(part) > MAX_CHAT_CONTEXT_CHARS:
+            parts.append(orjson.dumps({'documents_omitted': len(session_docs) - index}).decode())
+            break
+        parts.append(part)
+        used += len(part)
+    
+    return parts
 
 def generate_chat_response(message, context):
     """Generate chat response using Claude Haiku"""
     try:
-        prompt = f"""You are analyzing invoice data. Answer the user's question based on this data:
+        # Session data goes in the system prompt after the fixed instructions,
+        # one block per document in upload order. Bedrock only reuses a cached
+        # prefix that ends at a cache point, so the last few documents each get
+        # one: after a new upload, the prefix ending at the previous last
+        # document is still cached and only the new document is read fresh
+        system = [{"text": CHAT_SYSTEM_PROMPT}]
+        cached_from = len(context) - CHAT_CACHE_POINTS
+        for index, part in enumerate(context):
+            system.append({"text": part})
+            if index >= cached_from:
+                system.append({"cachePoint": {"type": "default"}})
+        
+        return call_bedrock(
+            CLAUDE_HAIKU_MODEL,
+            message,
+            max_tokens=500,
+            temperature=0.7,
+            system=system
+        )
+        
+    except Exception as e:
+        logger.exception("Chat response generation failed")
+        return f"Sorry, I couldn't process your question: {str(e)}"
 
-{json.dumps(context, indent=2)}
+def parse_amount(value):
+    """Coerce an extracted amount (number or string like "$1,234.50", "USD 100.00" or "1.234,50") to float"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    
+    text = CURRENCY_PATTERN.sub('', value)
+    digits = text.lstrip('-')
+    if ',' in text and '.' in text:
+        # Whichever separator comes last is the decimal point
+        if text.rfind(',') > text.rfind('.'):
+            text = text.replace('.', '').replace(',', '.')
+        else:
+            text = text.replace(',', '')
+    elif COMMA_GROUPING_PATTERN.fullmatch(digits):
+        text = text.replace(',', '')
+    elif DOT_GROUPING_PATTERN.fullmatch(digits):
+        text = text.replace('.', '')
+    else:
+        # A lone comma that is not a thousands separator is a decimal comma
+        text = text.replace(',', '.', 1) if text.count(',') == 1 else text
+    
+    if not AMOUNT_PATTERN.fullmatch(text):
+        return None
+    return float(text)
 
-User question: {message}
+def pluralize(count, noun):
+    """Format a count with its noun, e.g. '1 invoice' or '3 invoices'"""
+    return f"{count} {noun}" if count == 1 else f"{count} {noun}s"
 
-Provide a clear, conversational answer."""
+def summarize_total_amount(session_docs):
+    """Sum total_amount across all session documents"""
+    amounts = [parse_amount((doc.get('structured_data') or {}).get('total_amount')) for doc in session_docs]
+    known = [amount for amount in amounts if amount is not None]
+    answer = f"The total amount across {pluralize(len(known), 'invoice')} is ${sum(known):,.2f}."
+    missing = len(amounts) - len(known)
+    if missing == 1:
+        answer += " 1 invoice had no readable total and was not included."
+    elif missing:
+        answer += f" {missing} invoices had no readable total and were not included."
+    return answer
 
-        # response = bedrock_client.invoke_model(
-        #     modelId=CLAUDE_HAIKU_MODEL,
-        #     body=json.dumps({
-        #         "anthropic_version": "bedrock-2023-05-31",
-        #         "max_tokens": 500,
-        #         "temperature": 0.7,
-        #         "messages": [{"role": "user", "content": prompt}]
-        #     })
-        # )
-        response = bedrock_client.invoke_model(
-            modelId=CLAUDE_HAIKU_MODEL,
-            body=json.dumps({
-                "messages": [{"role": "user", "content": [{"text": prompt}]}],
-                "inferenceConfig": {"maxTokens": 500, "temperature": 0.7}
-            })
-        )
-        
-        # result = json.loads(response['body'].read())
-        # return result['content'][0]['text']
+def summarize_average_amount(session_docs):
+    """Average total_amount across session documents with a readable total"""
+    known = [amount for amount in (parse_amount((doc.get('structured_data') or {}).get('total_amount')) for doc in session_docs)
+             if amount is not None]
+    if not known:
+        return "I couldn't find any invoice totals in this session."
+    return f"The average invoice amount across {pluralize(len(known), 'invoice')} is ${sum(known) / len(known):,.2f}."
 
-        result = json.loads(response['body'].read())
-        return result['output']['message']['content'][0]['text']
-        
-    except Exception as e:
-        return f"Sorry, I couldn't process your question: {str(e)}"
+def find_largest_invoice(session_docs):
+    """Report the document with the highest total_amount"""
+    largest = None
+    for doc in session_docs:
+        data = doc.get('structured_data') or {}
+        amount = parse_amount(data.get('total_amount'))
+        if amount is not None and (largest is None or amount > largest[0]):
+            largest = (amount, data, doc)
+    if largest is None:
+        return "I couldn't find any invoice totals in this session."
+    amount, data, doc = largest
+    vendor = data.get('vendor_name') or 'an unknown vendor'
+    number = data.get('invoice_number')
+    label = f"invoice {number}" if number else doc.get('filename', 'an invoice')
+    return f"The largest invoice is {label} from {vendor} at ${amount:,.2f}."
+
+def count_invoices(session_docs):
+    """Count documents in the session"""
+    if len(session_docs) == 1:
+        return "There is 1 invoice in this session."
+    return f"There are {len(session_docs)} invoices in this session."
+
+def count_vendors(session_docs):
+    """Count distinct vendor names in the session"""
+    vendors = {}
+    for doc in session_docs:
+        name = (doc.get('structured_data') or {}).get('vendor_name')
+        if isinstance(name, str) and name.strip():
+            vendors.setdefault(name.strip().lower(), name.strip())
+    if not vendors:
+        return "I couldn't find any vendor names in this session's invoices."
+    names = ', '.join(sorted(vendors.values()))
+    if len(vendors) == 1:
+        return f"There is 1 distinct vendor: {names}."
+    return f"There are {len(vendors)} distinct vendors: {names}."
+
+# Whole-question patterns (matched against the lowercased, whitespace-collapsed
+# message) that can be answered without a model call
+AGGREGATION_QUERIES = [
+    (re.compile(r"(?:what(?:'s| is) )?(?:the )?(?:grand )?total (?:amount|cost|spend|spent)"
+                r"(?: (?:of|across|for) (?:all )?(?:the |my |these )?invoices)?"), summarize_total_amount),
+    (re.compile(r"(?:what(?:'s| is) )?(?:the )?sum of (?:all )?(?:the |my |these )?invoices"
+                r"|how much (?:do i owe|did i spend|is (?:owed|due)|in total)(?: (?:in|across|for) (?:all )?(?:the |my |these )?invoices)?"),
+     summarize_total_amount),
+    (re.compile(r"(?:what(?:'s| is) )?(?:the )?average (?:invoice )?(?:amount|total|cost)(?: (?:of|across|per) (?:all )?(?:the |my |these )?invoices?)?"),
+     summarize_average_amount),
+    (re.compile(r"(?:what(?:'s| is) |which is )?(?:the )?(?:largest|biggest|highest|most expensive) invoice"), find_largest_invoice),
+    (re.compile(r"how many invoices(?: (?:are there|do i have|have i uploaded|are in (?:this|the) session))?"), count_invoices),
+    (re.compile(r"how many (?:different |distinct |unique )?vendors(?: (?:are there|do i have))?"), count_vendors),
+]
+
+def answer_aggregation_query(message, session_docs):
+    """Return a direct answer for simple aggregate questions, or None to defer to the model"""
+    normalized = ' '.join(message.lower().split()).rstrip('?.! ')
+    for pattern, aggregate in AGGREGATION_QUERIES:
+        if pattern.fullmatch(normalized):
+            return aggregate(session_docs)
+    return None
 
-def store_document(file_content, filename, session_id, raw_text, structured_data):
-    """Store document and metadata in S3"""
+def upload_file(file_content, filename, session_id):
+    """Store the uploaded file in S3 and return its key"""
+    pdf_key = f"sessions/{session_id}/documents/{filename}"
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=pdf_key,
+        Body=file_content,
+        ContentType='application/pdf'
+    )
+    return pdf_key
+
+def store_document(file_upload, filename, session_id, raw_text, structured_data):
+    """Store document metadata in S3 once the file upload has finished"""
     try:
-        doc_id = hashlib.md5(f"{session_id}_{filename}".encode()).hexdigest()
-        
-        # Store PDF
-        pdf_key = f"sessions/{session_id}/documents/{filename}"
-        s3_client.put_object(
+        doc_id = hashlib.blake2b(f"{session_id}_{filename}".encode(), digest_size=16).hexdigest()
+        pdf_key = file_upload.result()
+        
+        # Raw text is kept out of the metadata object, which chat reads for
+        # every document but only needs structured_data from. It is stored as a
+        # plain gzip file (no Content-Encoding), so downloads match the .gz key
+        text_key = f"sessions/{session_id}/text/{doc_id}.txt.gz"
+        text_upload = executor.submit(
+            s3_client.put_object,
             Bucket=S3_BUCKET,
-            Key=pdf_key,
-            Body=file_content,
-            ContentType='application/pdf'
+            Key=text_key,
+            Body=gzip.compress(raw_text.encode('utf-8'), compresslevel=6),
+            ContentType='application/gzip'
         )
         
         # Store metadata
@@ -464,7 +856,7 @@ def store_document(file_content, filename, session_id, raw_text, structured_data
             'session_id': session_id,
             'filename': filename,
             's3_location': pdf_key,
-            'raw_text': raw_text,
+            'text_location': text_key,
             'structured_data': structured_data,
             'timestamp': datetime.utcnow().isoformat()
         }
@@ -473,9 +865,10 @@ def store_document(file_content, filename, session_id, raw_text, structured_data
         s3_client.put_object(
             Bucket=S3_BUCKET,
             Key=metadata_key,
-            Body=json.dumps(metadata),
+            Body=orjson.dumps(metadata),
             ContentType='application/json'
         )
+        text_upload.result()
         
         return doc_id
         
@@ -491,25 +884,82 @@ def get_session_documents(session_id):
         )
         
         documents = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                metadata_response = s3_client.get_object(
-                    Bucket=S3_BUCKET,
-                    Key=obj['Key']
-                )
-                metadata = json.loads(metadata_response['Body'].read())
-                documents.append(metadata)
-        
+        fetches = []
+        for obj in response.get('Contents', []):
+            # Reuse metadata this container already read unless it changed
+            cached = _metadata_cache.get(obj['Key'])
+            if cached and cached[0] == obj['ETag']:
+                _metadata_cache.move_to_end(obj['Key'])
+                documents.append(cached[1])
+            else:
+                fetches.append((obj['Key'], executor.submit(fetch_metadata, obj['Key'])))
+        
+        # Misses are fetched concurrently; results are cached from this thread
+        for key, fetch in fetches:
+            etag, metadata = fetch.result()
+            _metadata_cache[key] = (etag, metadata)
+            _metadata_cache.move_to_end(key)
+            if len(_metadata_cache) > METADATA_CACHE_SIZE:
+                _metadata_cache.popitem(last=False)
+            documents.append(metadata)
+        
+        # Keys are listed in doc_id (hash) order; upload order keeps earlier
+        # documents at the same position in the chat context, so a new upload
+        # extends the cached prompt prefix instead of reshuffling it
+        documents.sort(key=lambda doc: doc.get('timestamp', ''))
         return documents
         
     except Exception:
+        logger.exception("Failed to load documents for session %s", session_id)
         return []
 
-def get_cors_headers():
-    """Return standard CORS headers"""
+def fetch_metadata(key):
+    """Read one metadata object, returning its ETag and parsed contents"""
+    metadata_response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+    return metadata_response['ETag'], orjson.loads(metadata_response['Body'].read())
+
+def encode_json(data):
+    """Serialize a response body with orjson"""
+    return orjson.dumps(data, default=str).decode()
+
+def compress_response(event, response):
+    """Gzip a large response body when the request's Accept-Encoding allows it"""
+    body = response.get('body')
+    if not body or len(body) < RESPONSE_MIN_COMPRESSION_SIZE:
+        return response
+    
+    # REST API events keep header case; HTTP API events lowercase every name
+    headers = event.get('headers') or {}
+    accept_encoding = next((value for name, value in headers.items() if name.lower() == 'accept-encoding'), '')
+    if not accepts_gzip(accept_encoding or ''):
+        return response
+    
     return {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-        'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,DELETE',
-        'Content-Type': 'application/json'
+        **response,
+        'headers': {**response['headers'], 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(gzip.compress(body.encode(), compresslevel=5)).decode(),
+        'isBase64Encoded': True
     }
+
+def accepts_gzip(accept_encoding):
+    """Check an Accept-Encoding header for gzip (or *) with a non-zero quality"""
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            key, _, quality = params.partition('=')
+            if key.strip().lower() != 'q':
+                return True
+            try:
+                return float(quality) > 0
+            except ValueError:
+                return False
+    return False
+
+def get_cors_headers():
+    """Return standard CORS headers"""
+    return CORS_HEADERS
+
+# Provisioned environments are initialized ahead of traffic, so warming the
+# connection pools there moves the TLS handshakes out of request latency
+if os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency':
+    prime_connections()
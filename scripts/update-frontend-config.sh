@@ -6,7 +6,7 @@ set -e
 
 if [ -z "$1" ]; then
     echo "Usage: $0 <api-gateway-url>"
-    echo "Example: $0 https://abc123.execute-api.us-west-2.amazonaws.com/prod"
+    echo "Example: $0 https://abc123.execute-api.us-west-2.amazonaws.com/"
     exit 1
 fi
 
@@ -0,0 +1,14 @@
+"""
+Test setup for the Lambda handler, which reads its settings from the environment at import
+"""
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+os.environ.setdefault('S3_BUCKET_NAME', 'test-bucket')
+os.environ.setdefault('NOVA_LITE_MODEL', 'nova-lite')
+os.environ.setdefault('CLAUDE_SONNET_MODEL', 'claude-sonnet')
+os.environ.setdefault('CLAUDE_HAIKU_MODEL', 'claude-haiku')
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'lambda'))
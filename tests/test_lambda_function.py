@@ -0,0 +1,58 @@
+import lambda_function as lf
+
+def make_doc(vendor_name, total_amount=100):
+    return {'filename': f'{vendor_name}.pdf', 'structured_data': {'vendor_name': vendor_name, 'total_amount': total_amount}}
+
+def test_count_invoices_single():
+    assert lf.answer_aggregation_query("How many invoices?", [make_doc('Acme')]) == \
+        "There is 1 invoice in this session."
+
+def test_count_invoices_multiple():
+    docs = [make_doc('Acme'), make_doc('Globex')]
+    assert lf.answer_aggregation_query("How many invoices?", docs) == \
+        "There are 2 invoices in this session."
+
+def test_count_vendors_single():
+    docs = [make_doc('Acme'), make_doc('acme')]
+    assert lf.answer_aggregation_query("How many vendors?", docs) == \
+        "There is 1 distinct vendor: Acme."
+
+def test_count_vendors_multiple():
+    docs = [make_doc('Acme'), make_doc('Globex')]
+    assert lf.answer_aggregation_query("How many vendors?", docs) == \
+        "There are 2 distinct vendors: Acme, Globex."
+
+def test_total_amount_single_and_missing():
+    docs = [make_doc('Acme', '$1,234.50'), make_doc('Globex', None)]
+    assert lf.answer_aggregation_query("What is the total amount?", docs) == \
+        "The total amount across 1 invoice is $1,234.50. 1 invoice had no readable total and was not included."
+
+def test_select_relevant_lines_bounds_single_line_text():
+    raw_text = "ACME Corp Invoice 1001 " + "Terms and conditions apply. " * 2000 + "Total $1,234.50"
+    selected = lf.select_relevant_lines(raw_text)
+    assert len(selected) <= lf.EXTRACTION_TEXT_LIMIT
+    assert selected.startswith("ACME Corp Invoice 1001")
+    assert selected.endswith("Total $1,234.50")
+
+def test_parse_amount_formats():
+    assert lf.parse_amount("$1,234.50") == 1234.5
+    assert lf.parse_amount("USD 100.00") == 100.0
+    assert lf.parse_amount("1.234,50") == 1234.5
+    assert lf.parse_amount("N/A") is None
+    assert lf.parse_amount("") is None
+
+def test_normalize_extraction_keeps_fields_with_unreadable_total():
+    result = lf.normalize_extraction({'vendor_name': 'Acme', 'invoice_number': '7', 'total_amount': 'N/A', 'line_items': []})
+    assert result == {'vendor_name': 'Acme', 'invoice_number': '7', 'total_amount': None, 'line_items': []}
+    assert not lf.is_valid_extraction({'vendor_name': 'Acme', 'total_amount': 'N/A'})
+
+def test_compress_response_when_gzip_accepted():
+    import base64, gzip
+    response = {'statusCode': 200, 'headers': lf.CORS_HEADERS, 'body': 'x' * lf.RESPONSE_MIN_COMPRESSION_SIZE}
+    compressed = lf.compress_response({'headers': {'accept-encoding': 'gzip, br'}}, response)
+    assert compressed['isBase64Encoded']
+    assert compressed['headers']['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(base64.b64decode(compressed['body'])).decode() == response['body']
+    assert 'Content-Encoding' not in lf.CORS_HEADERS
+    assert lf.compress_response({'headers': {'accept-encoding': 'gzip;q=0'}}, response) is response
+    assert lf.compress_response({}, response) is response